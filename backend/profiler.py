@@ -0,0 +1,291 @@
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+WATCHDOG_THREAD_NAME = "loop-lag-watchdog"
+
+# Innermost frames of threads parked waiting for work (thread pool workers,
+# anyio workers, pymongo monitors); they carry no signal for a flamegraph
+_IDLE_FRAMES = {
+    ("threading", "wait"),
+    ("queue", "get"),
+    ("concurrent.futures.thread", "_worker"),
+}
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profiling session is requested while one is running"""
+
+
+def _collapse_stack(frame) -> str:
+    """Render a frame chain root-first in flamegraph collapsed format"""
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _is_idle(frame) -> bool:
+    """Whether the innermost frame is a thread blocked waiting for work"""
+    return (frame.f_globals.get("__name__"), frame.f_code.co_name) in _IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """Statistical profiler that periodically samples the stacks of busy threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+
+    def _sample(self, duration: float, interval: float) -> Counter:
+        stacks = Counter()
+        own_ident = threading.get_ident()
+        thread_names = {}
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or _is_idle(frame):
+                    continue
+                if ident not in thread_names:
+                    # Threads may start mid-session; refresh names lazily
+                    thread_names = {t.ident: t.name for t in threading.enumerate()}
+                thread_name = thread_names.get(ident, f"thread-{ident}")
+                if thread_name == WATCHDOG_THREAD_NAME:
+                    continue
+                stacks[f"{thread_name};{_collapse_stack(frame)}"] += 1
+            time.sleep(interval)
+        return stacks
+
+    async def profile(self, duration: float, interval: float = 0.01) -> str:
+        """Sample for `duration` seconds and return collapsed stacks"""
+        with self._lock:
+            if self._running:
+                raise ProfilerBusyError("A profiling session is already running")
+            self._running = True
+        try:
+            # Sample from a worker thread so the event loop keeps serving requests
+            stacks = await asyncio.to_thread(self._sample, duration, interval)
+        finally:
+            self._running = False
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+class RequestTrace:
+    """Per-request timing breakdown by stage"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now()
+        self.request_id: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.error: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self.total_ms = 0.0
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Accumulate so retried stages (e.g. fallback keys) add up
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def finish(self, status_code: int):
+        self.status_code = status_code
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self) -> Dict:
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "status_code": self.status_code,
+            "total_ms": round(self.total_ms, 2),
+            "stages_ms": {name: round(ms, 2) for name, ms in self.stages.items()},
+            "error": self.error,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def note_error(message: str):
+    """Attach an error to the current request; a no-op outside of a traced request"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.error = message
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the current request; a no-op outside of a traced request"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+class RequestTracingMiddleware:
+    """ASGI middleware that traces gateway requests into the slow-request log"""
+
+    def __init__(self, app, slow_request_log: "SlowRequestLog", path_prefix: str = "/v1/"):
+        self.app = app
+        self.slow_request_log = slow_request_log
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            trace.finish(status_code)
+            self.slow_request_log.record(trace)
+
+
+class SlowRequestLog:
+    """Bounded log of requests that exceeded the latency threshold"""
+
+    def __init__(self, threshold_ms: float, max_entries: int = 100):
+        self.threshold_ms = threshold_ms
+        self.entries = deque(maxlen=max_entries)
+
+    def record(self, trace: RequestTrace):
+        if trace.total_ms >= self.threshold_ms:
+            self.entries.append(trace.to_dict())
+
+    def get_entries(self) -> List[Dict]:
+        return list(reversed(self.entries))
+
+
+class LoopLagMonitor:
+    """
+    Detect event loop stalls. A heartbeat task measures scheduling lag and a
+    watchdog thread captures the loop thread's stack while it is blocked, which
+    points at the synchronous call (e.g. a pymongo query) holding the loop.
+    """
+
+    def __init__(self, threshold_ms: float, interval: float = 0.05, max_events: int = 100):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.events = deque(maxlen=max_events)
+        self.max_lag_ms = 0.0
+        self.last_lag_ms = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stall_event: Optional[Dict] = None
+        # Guards the _last_beat / _stall_event hand-off between loop and watchdog
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch, name=WATCHDOG_THREAD_NAME, daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max(0.0, (now - before - self.interval) * 1000)
+            self.last_lag_ms = lag_ms
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            with self._lock:
+                self._last_beat = now
+                stall = self._stall_event
+                self._stall_event = None
+
+            if stall is not None:
+                stall["lag_ms"] = round(lag_ms, 2)
+            elif lag_ms >= self.threshold * 1000:
+                # Stall shorter than the watchdog could catch; record it without a stack
+                self.events.append({
+                    "detected_at": datetime.now(),
+                    "lag_ms": round(lag_ms, 2),
+                    "stack": None,
+                })
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            # The lock only ensures the heartbeat has not consumed this stall yet;
+            # the loop may already have moved on to another callback
+            with self._lock:
+                blocked_for = time.monotonic() - self._last_beat - self.interval
+                if blocked_for < self.threshold or self._stall_event is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                # Snapshot file/line positions cheaply; source lines are read later
+                summary = traceback.StackSummary.extract(
+                    traceback.walk_stack(frame), lookup_lines=False
+                )
+                event = {
+                    "detected_at": datetime.now(),
+                    "lag_ms": None,
+                    "stack": None,
+                }
+                self._stall_event = event
+                self.events.append(event)
+            summary.reverse()
+            event["stack"] = summary.format()
+
+    def get_stats(self) -> Dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "last_lag_ms": round(self.last_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "events": list(reversed(self.events)),
+        }
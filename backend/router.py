@@ -5,6 +5,7 @@ import json
 import uuid
 from datetime import datetime
 import os
+from profiler import note_error, stage
 from models import ChatCompletionRequest, ChatCompletionResponse, Usage as UsageModel, Choice, ChatMessage, ChatUsage
 
 class ModelRouter:
@@ -16,7 +17,8 @@ class ModelRouter:
         """Route chat completion request to appropriate AI service"""
         
         # Get available key for the model
-        key_info = self.db_manager.get_available_key_for_model(request.model)
+        with stage("key_selection"):
+            key_info = self.db_manager.get_available_key_for_model(request.model)
         if not key_info:
             raise Exception(f"No available API key for model {request.model}")
         
@@ -35,16 +37,17 @@ class ModelRouter:
                 response = await self._mock_completion(request)
             
             # Record successful usage
-            usage = UsageModel(
-                key_id=key_info.key_id,
-                model=request.model,
-                prompt_tokens=response.usage.prompt_tokens,
-                completion_tokens=response.usage.completion_tokens,
-                total_cost=self._calculate_cost(request.model, response.usage),
-                request_id=request_id,
-                status="success"
-            )
-            self.db_manager.record_usage(usage)
+            with stage("usage_write"):
+                usage = UsageModel(
+                    key_id=key_info.key_id,
+                    model=request.model,
+                    prompt_tokens=response.usage.prompt_tokens,
+                    completion_tokens=response.usage.completion_tokens,
+                    total_cost=self._calculate_cost(request.model, response.usage),
+                    request_id=request_id,
+                    status="success"
+                )
+                self.db_manager.record_usage(usage)
             
             return response
             
@@ -53,7 +56,8 @@ class ModelRouter:
             self.db_manager.record_error(key_info.key_id)
             
             # Try fallback key
-            fallback_key = self.db_manager.get_available_key_for_model(request.model)
+            with stage("key_selection"):
+                fallback_key = self.db_manager.get_available_key_for_model(request.model)
             if fallback_key and fallback_key.key_id != key_info.key_id:
                 return await self.route_chat_completion(request, request_id)
             
@@ -75,20 +79,24 @@ class ModelRouter:
         }
         
         try:
-            response = await self.client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload
-            )
+            with stage("upstream"):
+                response = await self.client.post(
+                    "https://api.openai.com/v1/chat/completions",
+                    headers=headers,
+                    json=payload
+                )
             
             if response.status_code == 200:
-                data = response.json()
-                return self._format_openai_response(data, request.model)
+                with stage("formatting"):
+                    data = response.json()
+                    return self._format_openai_response(data, request.model)
             else:
                 # Fallback to mock response
+                note_error(f"OpenAI returned HTTP {response.status_code}, served mock response")
                 return await self._mock_completion(request)
                 
-        except Exception:
+        except Exception as e:
+            note_error(f"{type(e).__name__}: {e}, served mock response")
             return await self._mock_completion(request)
     
     async def _route_to_anthropic(self, request: ChatCompletionRequest, api_key: str) -> ChatCompletionResponse:
@@ -109,41 +117,42 @@ class ModelRouter:
     
     async def _mock_completion(self, request: ChatCompletionRequest) -> ChatCompletionResponse:
         """Generate a mock completion response"""
-        # Extract last message for context
-        last_message = request.messages[-1].content if request.messages else "Hello"
+        with stage("formatting"):
+            # Extract last message for context
+            last_message = request.messages[-1].content if request.messages else "Hello"
         
-        # Generate a mock response based on the model
-        model_responses = {
-            "gpt-4": f"I'm GPT-4 responding to: {last_message}. This is a mock response from the OpenRouter clone.",
-            "claude-3-opus": f"As Claude 3 Opus, I'll address your message: {last_message}. This is a demonstration response.",
-            "gemini-pro": f"Gemini Pro here. Regarding '{last_message}' - this is a sample response from the API gateway.",
-            "mistral-large": f"Mistral Large processing: {last_message}. Mock response generated successfully."
-        }
+            # Generate a mock response based on the model
+            model_responses = {
+                "gpt-4": f"I'm GPT-4 responding to: {last_message}. This is a mock response from the OpenRouter clone.",
+                "claude-3-opus": f"As Claude 3 Opus, I'll address your message: {last_message}. This is a demonstration response.",
+                "gemini-pro": f"Gemini Pro here. Regarding '{last_message}' - this is a sample response from the API gateway.",
+                "mistral-large": f"Mistral Large processing: {last_message}. Mock response generated successfully."
+            }
         
-        response_text = model_responses.get(
-            request.model, 
-            f"Model {request.model} responding to: {last_message}. This is a mock response from the unified API gateway."
-        )
+            response_text = model_responses.get(
+                request.model, 
+                f"Model {request.model} responding to: {last_message}. This is a mock response from the unified API gateway."
+            )
         
-        # Simulate token usage
-        prompt_tokens = sum(len(msg.content.split()) for msg in request.messages) * 1.3
-        completion_tokens = len(response_text.split()) * 1.3
+            # Simulate token usage
+            prompt_tokens = sum(len(msg.content.split()) for msg in request.messages) * 1.3
+            completion_tokens = len(response_text.split()) * 1.3
         
-        return ChatCompletionResponse(
-            model=request.model,
-            choices=[
-                Choice(
-                    index=0,
-                    message=ChatMessage(role="assistant", content=response_text),
-                    finish_reason="stop"
+            return ChatCompletionResponse(
+                model=request.model,
+                choices=[
+                    Choice(
+                        index=0,
+                        message=ChatMessage(role="assistant", content=response_text),
+                        finish_reason="stop"
+                    )
+                ],
+                usage=ChatUsage(
+                    prompt_tokens=int(prompt_tokens),
+                    completion_tokens=int(completion_tokens), 
+                    total_tokens=int(prompt_tokens + completion_tokens)
                 )
-            ],
-            usage=UsageModel(
-                prompt_tokens=int(prompt_tokens),
-                completion_tokens=int(completion_tokens), 
-                total_tokens=int(prompt_tokens + completion_tokens)
             )
-        )
     
     def _format_openai_response(self, data: Dict[str, Any], model: str) -> ChatCompletionResponse:
         """Format OpenAI API response to our standard format"""
@@ -160,7 +169,7 @@ class ModelRouter:
             ))
         
         usage_data = data.get("usage", {})
-        usage = UsageModel(
+        usage = ChatUsage(
             prompt_tokens=usage_data.get("prompt_tokens", 0),
             completion_tokens=usage_data.get("completion_tokens", 0),
             total_tokens=usage_data.get("total_tokens", 0)
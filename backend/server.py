@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException, Depends, Security, status
+from fastapi import FastAPI, HTTPException, Depends, Security, Query, status
 from fastapi.security.api_key import APIKeyHeader, APIKey
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from typing import List, Dict
 import uuid
 from datetime import datetime, timedelta
@@ -11,6 +12,10 @@ from models import (
 )
 from database import DatabaseManager
 from router import ModelRouter
+from profiler import (
+    SamplingProfiler, ProfilerBusyError, SlowRequestLog, LoopLagMonitor,
+    RequestTracingMiddleware, current_trace, stage
+)
 
 app = FastAPI(
     title="OpenRouter Clone API",
@@ -27,6 +32,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profiling and latency diagnostics
+profiler = SamplingProfiler()
+slow_request_log = SlowRequestLog(float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', '1000')))
+loop_lag_monitor = LoopLagMonitor(float(os.getenv('LOOP_LAG_THRESHOLD_MS', '100')))
+
+# Slow-request tracing for gateway routes
+app.add_middleware(RequestTracingMiddleware, slow_request_log=slow_request_log)
+
 # Initialize database and router
 db_manager = DatabaseManager()
 model_router = ModelRouter(db_manager)
@@ -39,22 +52,31 @@ ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', 'admin-key-12345')
 VALID_API_KEYS = [ADMIN_API_KEY, "user-key-demo"]  # In production, store in database
 
 async def get_api_key(api_key: str = Security(api_key_header)) -> str:
-    if not api_key:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="API key required"
-        )
-    
-    # Remove 'Bearer ' prefix if present
-    if api_key.startswith('Bearer '):
-        api_key = api_key[7:]
-    
-    if api_key not in VALID_API_KEYS:
+    with stage("auth"):
+        if not api_key:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="API key required"
+            )
+        
+        # Remove 'Bearer ' prefix if present
+        if api_key.startswith('Bearer '):
+            api_key = api_key[7:]
+        
+        if api_key not in VALID_API_KEYS:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API key"
+            )
+        
+        return api_key
+
+async def get_admin_key(api_key: str = Depends(get_api_key)) -> str:
+    if api_key != ADMIN_API_KEY:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API key"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin API key required"
         )
-    
     return api_key
 
 @app.get("/")
@@ -78,11 +100,16 @@ async def chat_completions(
     Create a chat completion using the specified model.
     Compatible with OpenAI's chat completions API.
     """
+    trace = current_trace()
     try:
         request_id = f"req-{uuid.uuid4().hex[:8]}"
+        if trace:
+            trace.request_id = request_id
         response = await model_router.route_chat_completion(request, request_id)
         return response
     except Exception as e:
+        if trace:
+            trace.error = f"{type(e).__name__}: {e}"
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing request: {str(e)}"
@@ -191,9 +218,45 @@ async def get_api_keys_status():
             detail=f"Error fetching API keys: {str(e)}"
         )
 
+@app.post("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(get_admin_key)])
+async def run_profiler(
+    seconds: float = Query(default=10.0, gt=0, le=120),
+    interval_ms: float = Query(default=10.0, ge=1, le=1000)
+):
+    """
+    Sample busy threads for N seconds and return flamegraph collapsed stacks (Admin only).
+    Threads parked waiting for work are left out.
+    """
+    try:
+        return await profiler.profile(seconds, interval_ms / 1000)
+    except ProfilerBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+
+@app.get("/admin/slow-requests", dependencies=[Depends(get_admin_key)])
+async def get_slow_requests():
+    """Get recent requests over the latency threshold with per-stage timings (Admin only)"""
+    return {
+        "threshold_ms": slow_request_log.threshold_ms,
+        "requests": slow_request_log.get_entries()
+    }
+
+@app.get("/admin/loop-lag", dependencies=[Depends(get_admin_key)])
+async def get_loop_lag():
+    """Get event loop lag statistics and stacks of blocking calls (Admin only)"""
+    return loop_lag_monitor.get_stats()
+
+@app.on_event("startup")
+async def startup_event():
+    """Start background monitors"""
+    loop_lag_monitor.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    await loop_lag_monitor.stop()
     await model_router.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+import asyncio
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+
+from models import APIKeyInfo
+from profiler import (
+    LoopLagMonitor, ProfilerBusyError, RequestTrace, SamplingProfiler, SlowRequestLog
+)
+
+
+def test_loop_lag_monitor_captures_blocking_call():
+    async def run():
+        monitor = LoopLagMonitor(threshold_ms=50, interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.3)  # blocking call
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return monitor.get_stats()
+
+    stats = asyncio.run(run())
+    events = [event for event in stats["events"] if event["stack"]]
+    assert len(events) == 1
+    assert "time.sleep(0.3)" in events[0]["stack"][-1]
+    assert events[0]["lag_ms"] >= 250
+    assert stats["max_lag_ms"] >= 250
+
+
+def test_sampling_profiler_rejects_concurrent_sessions():
+    release = threading.Event()
+    parked = threading.Thread(target=release.wait, name="parked-worker")
+    parked.start()
+
+    async def run():
+        profiler = SamplingProfiler()
+        first = asyncio.create_task(profiler.profile(0.2))
+        await asyncio.sleep(0.05)
+        with pytest.raises(ProfilerBusyError):
+            await profiler.profile(0.1)
+        return await first
+
+    try:
+        stacks = asyncio.run(run())
+    finally:
+        release.set()
+        parked.join()
+    assert "MainThread;" in stacks
+    assert "parked-worker" not in stacks
+
+
+def test_request_trace_accumulates_repeated_stages():
+    trace = RequestTrace("POST", "/v1/chat/completions")
+    for _ in range(2):
+        with trace.stage("key_selection"):
+            time.sleep(0.02)
+    trace.finish(200)
+
+    stages = trace.to_dict()["stages_ms"]
+    assert list(stages) == ["key_selection"]
+    assert stages["key_selection"] >= 40
+    assert trace.total_ms >= stages["key_selection"]
+
+
+def _finished_trace(path: str, total_ms: float) -> RequestTrace:
+    trace = RequestTrace("POST", path)
+    trace.finish(200)
+    trace.total_ms = total_ms
+    return trace
+
+
+def test_slow_request_log_threshold_and_maxlen():
+    log = SlowRequestLog(threshold_ms=100, max_entries=2)
+    log.record(_finished_trace("/fast", 99))
+    for path in ("/a", "/b", "/c"):
+        log.record(_finished_trace(path, 150))
+
+    assert [entry["path"] for entry in log.get_entries()] == ["/c", "/b"]
+
+
+class FakeCollection:
+    def find_one(self, *args, **kwargs):
+        return None
+
+
+class FakeDatabaseManager:
+    def __init__(self):
+        self.models = FakeCollection()
+
+    def get_available_key_for_model(self, model):
+        return APIKeyInfo(key_id="key_1", key_hash="hash", original_key="key")
+
+    def record_usage(self, usage):
+        pass
+
+    def record_error(self, key_id):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    import database
+
+    monkeypatch.setenv("SLOW_REQUEST_THRESHOLD_MS", "0")
+    monkeypatch.setattr(database, "DatabaseManager", FakeDatabaseManager)
+    monkeypatch.delitem(sys.modules, "server", raising=False)
+    import server
+    yield server
+    # Don't leak a server built on the fake database into other tests
+    sys.modules.pop("server", None)
+
+
+@pytest.fixture
+def client(server):
+    from fastapi.testclient import TestClient
+
+    return TestClient(server.app)
+
+
+def test_admin_endpoints_require_admin_key(client):
+    headers = {"Authorization": "Bearer user-key-demo"}
+    for method, path in [
+        ("post", "/admin/profile?seconds=0.1"),
+        ("get", "/admin/slow-requests"),
+        ("get", "/admin/loop-lag"),
+    ]:
+        response = getattr(client, method)(path, headers=headers)
+        assert response.status_code == 403
+
+
+def test_chat_completion_stages_recorded(client):
+    response = client.post(
+        "/v1/chat/completions",
+        headers={"Authorization": "Bearer user-key-demo"},
+        json={"model": "claude-3-opus", "messages": [{"role": "user", "content": "Hi"}]},
+    )
+    assert response.status_code == 200
+
+    admin_headers = {"Authorization": "Bearer admin-key-12345"}
+    response = client.post("/admin/profile?seconds=0.1", headers=admin_headers)
+    assert response.status_code == 200
+
+    response = client.get("/admin/slow-requests", headers=admin_headers)
+    requests = response.json()["requests"]
+    assert [r["path"] for r in requests] == ["/v1/chat/completions"]
+    assert set(requests[0]["stages_ms"]) == {"auth", "key_selection", "formatting", "usage_write"}
+    assert requests[0]["request_id"].startswith("req-")
+
+
+def test_swallowed_upstream_error_recorded(server, client, monkeypatch):
+    async def failing_post(*args, **kwargs):
+        raise httpx.ConnectTimeout("connect timed out")
+
+    monkeypatch.setattr(server.model_router.client, "post", failing_post)
+    response = client.post(
+        "/v1/chat/completions",
+        headers={"Authorization": "Bearer user-key-demo"},
+        json={"model": "gpt-4", "messages": [{"role": "user", "content": "Hi"}]},
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        "/admin/slow-requests", headers={"Authorization": "Bearer admin-key-12345"}
+    )
+    entry = response.json()["requests"][0]
+    assert entry["status_code"] == 200
+    assert entry["error"].startswith("ConnectTimeout: connect timed out")
+    assert {"upstream", "formatting"} <= set(entry["stages_ms"])